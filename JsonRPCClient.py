@@ -9,37 +9,60 @@ import json
 import socket
 import queue
 import sys
-from PyQt5.QtCore import QThread, pyqtSignal, QObject
-from PyQt5.QtNetwork import QTcpSocket
-from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5 import QtWidgets, uic
 
 DEBUG = 0
+TERMINATOR : bytes = b"\n"
+RECV_SIZE : int = 65536
+MAX_FRAME_SIZE : int = 1048576
+JSON_ENCODER : json.JSONEncoder = json.JSONEncoder(separators = (",", ":"))
+
+RPC_ERRORS : dict[int, str] = {
+    -32700 : "Parse Error",
+    -32600 : "Invalname Request",
+    -32601 : "Method not found",
+    -32602 : "Invalname params",
+    -32603 : "Internal error"
+}
 
 class TCPSendHandler(QThread):
     
     def __init__(self, parent, client_socket):
         super().__init__(parent)
         self.client_socket = client_socket
-        self._msg_queue = queue.Queue()
+        self._msg_queue = queue.SimpleQueue()
         self.parent = parent
             
     def run(self):
+        get = self._msg_queue.get
+        empty = self._msg_queue.empty
+        send_messages = self.sendMessages
         while True:
-            if not self._msg_queue.empty():
-                self.sendMessage(self._msg_queue.get())
+            items = [get()]
+            while not empty():
+                items.append(get())
+            send_messages(items)
     
     def addRPCQueue(self, item : json = None) -> None:
         self._msg_queue.put(item)
         
-    def sendMessage(self, item : json = None) -> None:
+    def sendMessages(self, items : list) -> None:
+        """
+            items: list of RPC items. They are sent in a single write, each 
+            followed by TERMINATOR
+        """
         if not DEBUG:
-            self.client_socket.sendall(json.dumps(item).encode('utf-8'))
+            self.client_socket.sendall(b"".join(
+                JSON_ENCODER.encode(item).encode('utf-8') + TERMINATOR
+                for item in items
+            ))
         else:
-            print(item)
+            for item in items:
+                print(item)
             
 class TCPListenHandler(QThread):
-    message_received = pyqtSignal(str)
+    message_received = pyqtSignal(object)
     
     def __init__(self, parent, client_socket):
         super().__init__(parent)
@@ -48,54 +71,61 @@ class TCPListenHandler(QThread):
         self.message_received.connect(self.parent.notified)
                 
     def run(self):
+        chunk = memoryview(bytearray(RECV_SIZE))
+        buffer = bytearray()
+        scan = 0
+        recv_into = self.client_socket.recv_into
+        find = buffer.find
+        process_response = self.processResponse
         while True:
-            response = json.loads(self.client_socket.recv(1024).decode('utf-8'))
+            size = recv_into(chunk)
+            if not size:
+                break
+            buffer += chunk[:size]
+            start = 0
+            end = find(TERMINATOR, scan)
+            while end != -1:
+                process_response(json.loads(buffer[start:end]))
+                start = end + len(TERMINATOR)
+                end = find(TERMINATOR, start)
+            del buffer[:start]
+            if len(buffer) > MAX_FRAME_SIZE:
+                print(f"Response frame exceeds {MAX_FRAME_SIZE} bytes, "
+                      "connection is dropped")
+                self.client_socket.close()
+                break
+            scan = len(buffer)
+    
+    def processResponse(self, response : dict) -> None:
+        if DEBUG:
             print(response)
-            if hasattr(response, "error"):
-                error_code = response["error"]["code"]
-                error_message = response["error"]["message"]
-                if hasattr(response["error"],"data"):
-                    error_data = response["error"]["data"]
-                else:
-                    error_data = None
-                    
-                if error_code == -32700:
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Parse Error")
-                elif error_code == -32600:
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Invalname Request")
-                elif error_code == -32601:
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Method not found")
-                elif error_code == -32602:
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Invalname params")
-                elif error_code == -32603:
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Internal error")
-                elif (-32099 < error_code and error_code < -32000):
-                    print(error_message)
-                    print(error_data)
-                    raise Exception("Server error")
-            else:
-                self.message_received.emit(json.dumps(response))
+        if "error" in response:
+            error_code = response["error"]["code"]
+            error_message = response["error"]["message"]
+            error_data = response["error"].get("data")
                 
+            if error_code in RPC_ERRORS:
+                print(error_message)
+                print(error_data)
+                raise Exception(RPC_ERRORS[error_code])
+            elif -32099 <= error_code <= -32000:
+                print(error_message)
+                print(error_data)
+                raise Exception("Server error")
+        else:
+            self.message_received.emit(response)
+            
 
 class JsonRPCClient:
     def __init__(self, tcp_send_handler : TCPSendHandler, name : str = ""):
         self.tcp_send_handler : TCPSendHandler = tcp_send_handler
         self.name : str = name
-        self._notify_vars = []
+        self._notify_vars : set = set()
         self._get_all_attr()
     
     def __getattr__(self, method):
-        print(method)
+        if DEBUG:
+            print(method)
         if method == "_notify_vars" or method in self._notify_vars:
             return object.__getattribute__(self, method)
         else:
@@ -103,6 +133,7 @@ class JsonRPCClient:
                 if len(args) != 0:
                     raise Exception("only key based params are supported")
                 return self.__do_rpc(method, params)
+            self.__dict__[method] = proxy
             return proxy
 
     def __do_rpc(self, 
@@ -113,8 +144,6 @@ class JsonRPCClient:
             params,
             self.name
         )
-        json_data = json.dumps(item)
-        
         self.tcp_send_handler.addRPCQueue(item)
     
     def _get_all_attr(self) -> None:
@@ -148,6 +177,7 @@ class UiMainWindow(QtWidgets.QMainWindow, form_window):
         self.port : int = port
         if not DEBUG:
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.client_socket.connect((self.host, self.port))
         else:
             self.client_socket = None
@@ -164,15 +194,13 @@ class UiMainWindow(QtWidgets.QMainWindow, form_window):
     def hi(self):
         self.ad9912_0.hello()
     
-    def notified(self, message) -> None:
-        response = json.loads(message)
-        print(response["result"])
+    def notified(self, response : dict) -> None:
+        if DEBUG:
+            print(response["result"])
         class_obj = getattr(self,response["name"])
         for k, v in response["result"].items():
-            if not k in class_obj._notify_vars:
-                class_obj._notify_vars.append(k)
+            class_obj._notify_vars.add(k)
             setattr(class_obj,k,v)
-        print(class_obj.frequency)
         
 if __name__ == '__main__':
     host = "127.0.0.1"
@@ -6,14 +6,24 @@ Created on Thu Feb 22 17:07:33 2024
 """
 import json
 import argparse
+import os
 import sys
 import socket
 import importlib
 import threading
 import queue
 from types import MethodType
+from typing import Optional
+
+DEBUG = 0
 
 clients: list = []
+TERMINATOR : bytes = b"\n"
+RECV_SIZE : int = 65536
+MAX_FRAME_SIZE : int = 1048576
+QUEUE_TIMEOUT : float = 0.5
+RESERVED_METHODS : frozenset = frozenset({"getChangedAttributes"})
+JSON_ENCODER : json.JSONEncoder = json.JSONEncoder(separators = (",", ":"))
 
 class JsonRPCServer:
     host : str = None
@@ -24,15 +34,16 @@ class JsonRPCServer:
     def __init__(self):
         self.sockets : dict[socket] = {}
         self.conn : dict[int : object] = {}
+        self._message_queue = queue.SimpleQueue()
         for port in self.port_list:
             self.sockets[port] = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
+            if os.name == "posix":
+                self.sockets[port].setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.sockets[port].bind((self.host, port))
             self.sockets[port].listen()
             self.thread_list[port] = threading.Thread(target=self.listen, args=(port, ))
             self.thread_list[port].daemon = True
             self.thread_list[port].start()
-            
-        self._message_queue = queue.Queue()
     
     @classmethod
     def SetClassVars(cls, **kwargs) -> None:
@@ -43,49 +54,128 @@ class JsonRPCServer:
         print(f">> Server host : {self.host}, port : {port} opened")
         while True:
             conn, addr = self.sockets[port].accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.conn[port] = conn
             print(f">> Connection from {addr} on port {port}")
+            chunk = memoryview(bytearray(RECV_SIZE))
+            buffer = bytearray()
+            scan = 0
+            recv_into = conn.recv_into
+            find = buffer.find
+            put = self._message_queue.put
             while True:
                 try:
-                    message = conn.recv(1024)
-                    json_data = json.loads(message.decode('utf-8'))
-                    self._message_queue.put(json_data)
-                except:
+                    size = recv_into(chunk)
+                except OSError:
+                    size = 0
+                if not size:
                     print(f">> Connection from port {port} is lost")
                     break
+                buffer += chunk[:size]
+                start = 0
+                end = find(TERMINATOR, scan)
+                while end != -1:
+                    try:
+                        json_data = json.loads(buffer[start:end])
+                    except ValueError:
+                        json_data = None
+                    if isinstance(json_data, dict):
+                        put(json_data)
+                    else:
+                        print(f">> Invalid message from port {port} is ignored")
+                    start = end + len(TERMINATOR)
+                    end = find(TERMINATOR, start)
+                del buffer[:start]
+                if len(buffer) > MAX_FRAME_SIZE:
+                    print(f">> Frame from port {port} exceeds {MAX_FRAME_SIZE} "
+                          "bytes, connection is dropped")
+                    break
+                scan = len(buffer)
+            if self.conn.get(port) is conn:
+                del self.conn[port]
             conn.close()
     
     def run(self):
+        get = self._message_queue.get
+        empty = self._message_queue.empty
+        function_call = self.functionCall
+        make_notification = self.makeNotification
         while True:
-            if not self._message_queue.empty():
-                message = self._message_queue.get()
-                print(message)
-                self.functionCall(message)
+            try:
+                messages = [get(timeout = QUEUE_TIMEOUT)]
+            except queue.Empty:
+                continue
+            while not empty():
+                messages.append(get())
+            object_names = {}
+            for message in messages:
+                if DEBUG:
+                    print(message)
+                object_name = function_call(message)
+                if object_name is not None:
+                    object_names[object_name] = None
+            items = [make_notification(object_name) 
+                     for object_name in object_names]
+            items = [item for item in items if item is not None]
+            if items:
+                self.broadcast(items)
                     
-    def functionCall(self, item: json) -> None:
+    def functionCall(self, item: json) -> Optional[str]:
+        """
+            Returns the name of the device the request reached, even if the 
+            call failed, or None if it did not reach any device
+        """
+        if not (isinstance(item, dict)
+                and isinstance(item.get("name"), str)
+                and isinstance(item.get("method"), str)
+                and isinstance(item.get("params"), dict)):
+            print(f">> Invalid request {item} is ignored")
+            return None
         object_name = item["name"]
         method_name = item["method"]
+        if not object_name in self.device_list:
+            print(f">> Device {object_name} is not found")
+            return None
         obj = self.device_list[object_name]
-        method = getattr(obj, method_name)
-        if item["params"]:
-            return_value = method(**item["params"])
+        if method_name.startswith("_") or method_name in RESERVED_METHODS:
+            method = None
         else:
-            return_value = method()
-            
-        self.notify(object_name)
+            method = getattr(obj, method_name, None)
+        if not callable(method):
+            print(f">> Method {method_name} of {object_name} is not found")
+            return object_name
+        try:
+            method(**item["params"])
+        except Exception as e:
+            print(f">> Method {method_name} of {object_name} raised "
+                  f"{type(e).__name__}: {e}")
         
-        return
+        return object_name
     
-    def notify(self, object_name : str) -> None:
+    def makeNotification(self, object_name : str) -> Optional[str]:
         data = self.device_list[object_name].getChangedAttributes()
-        item = RPCResponse(
+        if not data:
+            return None
+        return RPCResponse(
             result = {key : getattr(self.device_list[object_name],key) 
                       for key in data},
             name = object_name
         )
-        for port, conn in self.conn.items():
-            print(item)
-            conn.sendall(item.encode('utf-8'))
+    
+    def broadcast(self, items : list) -> None:
+        """
+            items: list of RPCResponse strings. They are sent to each 
+            connection in a single write, each followed by TERMINATOR
+        """
+        if DEBUG:
+            for item in items:
+                print(item)
+        data = b"".join(item.encode('utf-8') + TERMINATOR for item in items)
+        for conn in list(self.conn.values()):
+            try:
+                conn.sendall(data)
+            except OSError:
+                pass
     
 def RPCResponse(
         result: object,
@@ -95,22 +185,7 @@ def RPCResponse(
         "result" : result,
         "name" : name
     }
-    return json.dumps(item)
-
-def getAllValue(item: json) -> json:
-    object_name = item.name
-    obj = globals()[object_name]
-    return RPCResponse(
-        name = object_name,
-        result = vars(obj)
-    )
-
-def setVariable(item: json) -> json:
-    object_name = item.name
-    return RPCResponse(
-        status = "OK", 
-        name_value = object_name,
-        value = None)
+    return JSON_ENCODER.encode(item)
 
 def CreateJsonRPCServer(json_file : str) -> JsonRPCServer:
     with open(json_file, 'r') as file:
@@ -121,7 +196,7 @@ def CreateJsonRPCServer(json_file : str) -> JsonRPCServer:
     for device_name, device_data in data.get('device', {}).items():
         module = importlib.import_module(device_data.get('import'))
         class_object = getattr(module,device_data.get('class'))(**device_data.get('args'))
-        if hasattr(device_data,'attr'):
+        if 'attr' in device_data:
             for key, value in device_data.get('attr').items():
                 setattr(class_object, key, value)
         setattr(class_object, "_notify_vars",device_data["_notify_vars"])
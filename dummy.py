@@ -5,18 +5,23 @@ Created on Wed Feb 28 14:17:13 2024
 @author: alexi
 """
 
+_SCALAR_TYPES : tuple = (bool, int, float, complex, str, bytes, type(None))
+
 class dummy_class:
+    _notify_vars : tuple = ()
+    
     def __init__(self, name : str):
+        object.__setattr__(self, "_changed_attributes", set())
         self.a = 1
         print('hihihi' + name)
         
     def __setattr__(self, name, value):
-        if (not name == '_changed_attributes') and (not name == '_notify_vars'):
-            if not hasattr(self, "_changed_attributes"):
-                self._changed_attributes = set()
-            if not hasattr(self, "_notify_vars"):
-                self._notify_vars = []
-            if name in self._notify_vars:
+        if name in self._notify_vars:
+            unchanged = (name in self.__dict__
+                         and isinstance(value, _SCALAR_TYPES)
+                         and type(self.__dict__[name]) is type(value)
+                         and self.__dict__[name] == value)
+            if not unchanged:
                 self._changed_attributes.add(name)
         super().__setattr__(name, value)
     